@@ -1,7 +1,10 @@
 from .utils import (
+    build_ecoinvent_index,
+    build_technosphere_index,
     import_ecoinvent_as_dict,
     import_biosphere_as_dict,
     get_ecoinvent_units,
+    get_excel_engine,
     get_simulation_lci_map,
     units_conversion,
     get_dataset_code,
@@ -12,11 +15,11 @@ from .utils import (
     write_db_to_bw,
 )
 
+from functools import cached_property
 from pathlib import Path
 import pandas as pd
 import numpy as np
 import brightway2 as bw
-import math
 import datetime
 import shutil
 
@@ -26,7 +29,9 @@ class Converter:
     Convert HSC Chemistry results to Brightway2 inventories.
     """
 
-    def __init__(self, metadata: str = None, export_dir: str = None):
+    def __init__(
+        self, metadata: str = None, export_dir: str = None, use_cache: bool = True
+    ):
         self.metadata = load_project_metadata(metadata)
 
         self.simulation_file = self.metadata["input files"]["simulation file"]
@@ -39,8 +44,11 @@ class Converter:
 
         self.activity_description = self.metadata["activity description"]
 
-        self.ecoinvent_db = import_ecoinvent_as_dict(self.source_db)
-        self.biosphere_db = import_biosphere_as_dict()
+        # keep a pickled copy of the Brightway databases to speed up later imports
+        self.use_cache = use_cache
+
+        # ecoinvent suppliers already resolved, keyed by location and exchange filter
+        self._datasets_for_location = {}
         self.ecoinvent_units = get_ecoinvent_units()
         self.simulation_lci_map = get_simulation_lci_map(self.mapping_file)
 
@@ -51,6 +59,86 @@ class Converter:
         else:
             self.export_dir = Path.cwd()
 
+    @cached_property
+    def ecoinvent_db(self) -> list:
+        """
+        ecoinvent database in wurst format, imported on first use
+        """
+        return import_ecoinvent_as_dict(self.source_db, use_cache=self.use_cache)
+
+    @cached_property
+    def biosphere_db(self) -> list:
+        """
+        biosphere database in wurst format, imported on first use
+        """
+        return import_biosphere_as_dict(use_cache=self.use_cache)
+
+    @cached_property
+    def _ecoinvent_index(self) -> dict:
+        return build_ecoinvent_index(self.ecoinvent_db)
+
+    @cached_property
+    def _ecoinvent_technosphere_index(self) -> dict:
+        return build_technosphere_index(self.ecoinvent_db)
+
+    def _get_dataset_for_location(self, location: str, exc_filter: dict) -> dict:
+        """
+        Cached version of `get_dataset_for_location` for the ecoinvent database.
+        The same exchange is usually supplied to several unit processes.
+        """
+        key = (location, exc_filter["name"], exc_filter["product"], exc_filter["unit"])
+        if key not in self._datasets_for_location:
+            self._datasets_for_location[key] = get_dataset_for_location(
+                location, exc_filter, self.ecoinvent_db, self._ecoinvent_index
+            )
+        return self._datasets_for_location[key]
+
+    def _get_exchange(self, row, location: str) -> dict:
+        """
+        Create the exchange for a technosphere or biosphere flow of a unit process.
+
+        :param row: row of the simulation results, as returned by `itertuples`
+        :param location: location of the unit process
+        :return: dictionary containing the exchange
+        """
+        lci_flow = self.simulation_lci_map[row.stream_name]
+
+        if row.lci_type == "technosphere":
+            exc_filter = {
+                "name": lci_flow["Name"],
+                "product": lci_flow["Reference product"],
+                "unit": row.unit,
+            }
+
+            try:
+                exc_dataset = self._get_dataset_for_location(location, exc_filter)
+            except IndexError:
+                raise ValueError(f"No LCI dataset available for {exc_filter}")
+
+            return {
+                "name": exc_dataset["name"],
+                "product": exc_dataset["reference product"],
+                "location": exc_dataset["location"],
+                "amount": row.amount,
+                "unit": row.unit,
+                "database": self.source_db,
+                "type": "technosphere",
+            }
+
+        if pd.isna(lci_flow["Subcategory"]):
+            categories = (lci_flow["Category"],)
+        else:
+            categories = (lci_flow["Category"], lci_flow["Subcategory"])
+
+        return {
+            "name": lci_flow["Name"],
+            "amount": row.amount,
+            "unit": row.unit,
+            "categories": categories,
+            "database": "biosphere3",
+            "type": "biosphere",
+        }
+
     def get_simulation_results_data(self):
         """
         Extract input and output streams data.
@@ -63,23 +151,26 @@ class Converter:
 
         print("Extract process simulation results data")
 
-        technosphere_flows = [
+        technosphere_flows = frozenset(
             i
-            for i in self.simulation_lci_map
-            if self.simulation_lci_map[i]["LCI flow type"] == "technosphere"
-        ]
-        biosphere_flows = [
+            for i, flow in self.simulation_lci_map.items()
+            if flow["LCI flow type"] == "technosphere"
+        )
+        biosphere_flows = frozenset(
             i
-            for i in self.simulation_lci_map
-            if self.simulation_lci_map[i]["LCI flow type"] == "biosphere"
-        ]
+            for i, flow in self.simulation_lci_map.items()
+            if flow["LCI flow type"] == "biosphere"
+        )
 
-        simulation_results_raw = pd.ExcelFile(self.simulation_file)
+        simulation_results_raw = pd.read_excel(
+            self.simulation_file,
+            sheet_name=["Input Streams", "Output Streams"],
+            engine=get_excel_engine(),
+        )
 
-        simulation_results_processed = pd.DataFrame()
+        simulation_results_sheets = []
 
-        for sheet in ["Input Streams", "Output Streams"]:
-            df = simulation_results_raw.parse(sheet)
+        for sheet, df in simulation_results_raw.items():
 
             # Format the imported df
             new_header = df.iloc[0]
@@ -101,124 +192,165 @@ class Converter:
             # For output streams, keep the Stream Properties
             elif sheet == "Output Streams":
 
+                # Keep only the columns used below
+                df = df[
+                    [
+                        "Unit Name",
+                        "Stream Name",
+                        "Amount",
+                        "Unit",
+                        "Stream Property Name",
+                        "Stream Property Amount",
+                        "Stream Property Unit",
+                    ]
+                ]
+
                 # Clean the properties data
-                for col in ["Stream Name", "Unit Name", "Amount", "Unit"]:
-                    df[col].fillna(method="ffill", inplace=True)
+                stream_columns = ["Stream Name", "Unit Name", "Amount", "Unit"]
+                df[stream_columns] = df[stream_columns].infer_objects().ffill()
 
                 df.dropna(subset=["Stream Property Name"], inplace=True)
                 df = df[df["Stream Property Name"] != "Name"]
-                df["Stream Property Amount"] = df["Stream Property Amount"].apply(
-                    lambda x: x.replace(",", ".") if isinstance(x, str) else x
-                )
-
+                # Amounts may be exported as text with a decimal comma
                 for col in ["Amount", "Stream Property Amount"]:
+                    if not pd.api.types.is_numeric_dtype(df[col]):
+                        df[col] = df[col].astype(str).str.replace(",", ".", regex=False)
                     df[col] = df[col].astype(float)
 
-                df = df.dropna(axis=1, how="all")
+                # Mass, solids and liquid flows of each stream, joined to its property rows
+                stream_properties = df.pivot_table(
+                    index="Stream Name",
+                    columns="Stream Property Name",
+                    values="Stream Property Amount",
+                    aggfunc="first",
+                )
+                flow_properties = [
+                    i
+                    for i in ["Mass Flow", "Total Solids Flow", "Total Liquid Flow"]
+                    if i in stream_properties.columns
+                ]
+                df = df.join(stream_properties[flow_properties], on="Stream Name")
+
+                # Output streams that are technosphere flows (i.e., solid waste and wastewater treatment)
+                is_technosphere = df["Stream Name"].isin(technosphere_flows).to_numpy()
+
+                # Flows missing from the workbook stay NaN until they are checked below
+                stream_flows = {
+                    i: (df[i].to_numpy() if i in df else np.full(len(df), np.nan))
+                    for i in ["Mass Flow", "Total Solids Flow", "Total Liquid Flow"]
+                }
 
-                # Get output data distinguishing between technosphere/biosphere
-                output_data = []
-                for index, row in df.iterrows():
+                # Every output stream needs its mass flow, and technosphere
+                # streams are split into their solids and liquid flows
+                for flow_property, required in [
+                    ("Mass Flow", np.ones(len(df), dtype=bool)),
+                    ("Total Solids Flow", is_technosphere),
+                    ("Total Liquid Flow", is_technosphere),
+                ]:
+                    missing = required & np.isnan(stream_flows[flow_property])
+                    if missing.any():
+                        raise ValueError(
+                            f"Output stream {df['Stream Name'].to_numpy()[missing][0]!r} "
+                            f"has no {flow_property!r} property"
+                        )
 
-                    stream_name = df.loc[index]["Stream Name"]
-                    stream_amount = float(df.loc[index]["Amount"])
-                    stream_unit = df.loc[index]["Unit"]
+                stream_amount = df["Amount"].to_numpy()
+                property_amount = df["Stream Property Amount"].to_numpy()
+                mass_flow = stream_flows["Mass Flow"]
+                total_solids_flow = stream_flows["Total Solids Flow"]
+                total_liquid_flow = stream_flows["Total Liquid Flow"]
 
-                    property_amount = df.loc[index]["Stream Property Amount"]
-                    property_unit = df.loc[index]["Stream Property Unit"]
+                # Waste heat or emission of substances to air, water, or soil
+                is_biosphere = (
+                    ~is_technosphere
+                    & df["Stream Property Name"].isin(biosphere_flows).to_numpy()
+                )
+                is_waste_heat = (
+                    df["Stream Property Unit"]
+                    .isin(["kW", "kWh", "kilowatt hour", "MJ", "megajoule"])
+                    .to_numpy()
+                )
 
-                    mass_flow = float(
-                        df[
-                            (df["Stream Name"] == stream_name)
-                            & (df["Stream Property Name"] == "Mass Flow")
-                        ]["Stream Property Amount"].values[0]
+                # Technosphere streams with solids or liquid flows and
+                # substance emissions are scaled by the stream mass flow
+                is_scaled = (
+                    is_technosphere
+                    & ((total_liquid_flow > 0) | (total_solids_flow > 0))
+                ) | (is_biosphere & ~is_waste_heat)
+                zero_mass_flow = is_scaled & (mass_flow == 0)
+                if zero_mass_flow.any():
+                    raise ValueError(
+                        f"Output stream {df['Stream Name'].to_numpy()[zero_mass_flow][0]!r} "
+                        f"has a zero 'Mass Flow' property"
                     )
 
-                    # Output streams that are technosphere flows (i.e., solid waste and wastewater treatment):
-                    if row["Stream Name"] in technosphere_flows:
-                        total_solids_flow = float(
-                            df[
-                                (df["Stream Name"] == stream_name)
-                                & (df["Stream Property Name"] == "Total Solids Flow")
-                            ]["Stream Property Amount"].values[0]
-                        )
-                        total_liquid_flow = float(
-                            df[
-                                (df["Stream Name"] == stream_name)
-                                & (df["Stream Property Name"] == "Total Liquid Flow")
-                            ]["Stream Property Amount"].values[0]
-                        )
+                # Stream amount per unit of mass flow, shared by all the cases below;
+                # left as NaN for the rows that are not scaled by it
+                amount_per_mass_flow = np.divide(
+                    stream_amount,
+                    mass_flow,
+                    out=np.full(len(df), np.nan),
+                    where=mass_flow != 0,
+                )
+
+                lci_amount = np.select(
+                    [
+                        is_technosphere & (total_liquid_flow > 0),
+                        is_technosphere & (total_solids_flow > 0),
+                        is_technosphere,
+                        is_waste_heat,
+                    ],
+                    [
+                        -total_liquid_flow * amount_per_mass_flow,
+                        -total_solids_flow * amount_per_mass_flow,
+                        0,
+                        property_amount,
+                    ],
+                    default=property_amount * amount_per_mass_flow,
+                )
 
-                        if total_solids_flow > 0:
-                            lci_amount = -total_solids_flow / mass_flow * stream_amount
-
-                        if total_liquid_flow > 0:
-                            lci_amount = -total_liquid_flow / mass_flow * stream_amount
-
-                        output_stream_data = {
-                            "Unit Name": row["Unit Name"],
-                            "Stream Name": row["Stream Name"],
-                            "Amount": lci_amount,
-                            "Unit": stream_unit,
-                        }
-                        if output_stream_data not in output_data:
-                            output_data.append(output_stream_data)
-
-                    else:
-                        if row["Stream Property Name"] in biosphere_flows:
-                            # Waste heat
-                            if row["Stream Property Unit"] in [
-                                "kW",
-                                "kWh",
-                                "kilowatt hour",
-                                "MJ",
-                                "megajoule",
-                            ]:
-                                lci_amount = property_amount
-                            # Emission of substances to air, water, or soil
-                            else:
-                                lci_amount = property_amount / mass_flow * stream_amount
-                        else:
-                            lci_amount = np.nan
-
-                        if not np.isnan(lci_amount):
-                            output_stream_data = {
-                                "Unit Name": row["Unit Name"],
-                                "Stream Name": row["Stream Property Name"],
-                                "Amount": lci_amount,
-                                "Unit": stream_unit,
-                            }
-
-                            if output_stream_data not in output_data:
-                                output_data.append(output_stream_data)
-
-                df = pd.DataFrame(output_data)
+                # Technosphere flows are reported once per stream,
+                # biosphere flows once per stream property
+                df = pd.DataFrame(
+                    {
+                        "Unit Name": df["Unit Name"].to_numpy(),
+                        "Stream Name": np.where(
+                            is_technosphere,
+                            df["Stream Name"].to_numpy(),
+                            df["Stream Property Name"].to_numpy(),
+                        ),
+                        "Amount": lci_amount,
+                        "Unit": df["Unit"].to_numpy(),
+                    }
+                )
+                df = df[is_technosphere | (is_biosphere & ~np.isnan(lci_amount))]
+                df = df.drop_duplicates()
                 df = df[df["Amount"] != 0]
 
             df["Stream type"] = sheet  # add stream type (input or output)
 
-            simulation_results_processed = pd.concat([simulation_results_processed, df])
+            simulation_results_sheets.append(df)
 
-        simulation_results_processed = simulation_results_processed.sort_values(
-            by="Unit Name"
+        simulation_results_processed = pd.concat(simulation_results_sheets).sort_values(
+            by="Unit Name", ignore_index=True
         )
-        simulation_results_processed.reset_index(inplace=True, drop=True)
 
         print("Apply strategies: Add technosphere/biosphere flow type")
-        simulation_results_processed["LCI type"] = np.where(
-            simulation_results_processed["Stream Name"].isin(technosphere_flows),
-            "technosphere",
-            np.where(
-                simulation_results_processed["Stream Name"].isin(biosphere_flows),
-                "biosphere",
-                None,
-            ),
+        stream_names = simulation_results_processed["Stream Name"]
+        simulation_results_processed["LCI type"] = np.select(
+            [
+                stream_names.isin(technosphere_flows),
+                stream_names.isin(biosphere_flows),
+            ],
+            ["technosphere", "biosphere"],
+            default=None,
         )
 
         print("Apply strategies: Change units to ecoinvent format")
-        simulation_results_processed["Unit"] = simulation_results_processed[
-            "Unit"
-        ].apply(lambda x: self.ecoinvent_units.get(x, x))
+        units = simulation_results_processed["Unit"]
+        simulation_results_processed["Unit"] = units.map(self.ecoinvent_units).fillna(
+            units
+        )
 
         print("Apply strategies: Convert process simulation units to ecoinvent units")
         units_conversion(simulation_results_processed)
@@ -243,14 +375,23 @@ class Converter:
 
         simulation_results_data = self.get_simulation_results_data()
 
-        # List of unit processes
-        unit_processes = list(set(simulation_results_data["Unit Name"]))
+        simulation_results_rows = simulation_results_data[
+            ["Unit Name", "Stream Name", "Amount", "Unit", "LCI type"]
+        ].rename(
+            columns={
+                "Unit Name": "unit_name",
+                "Stream Name": "stream_name",
+                "Amount": "amount",
+                "Unit": "unit",
+                "LCI type": "lci_type",
+            }
+        )
 
         inventories = []
 
         # Create inventory dicts for each unit process
         # !!! Each unit process produces "1 unit" of the unit process
-        for up in unit_processes:
+        for up, up_rows in simulation_results_rows.groupby("unit_name", sort=False):
             up_dict = {
                 "name": activity_name + ", " + up,
                 "reference product": activity_reference_product + ", " + up,
@@ -262,63 +403,12 @@ class Converter:
                 "comment": activity_comment,
             }
 
-            # Add exchanges to the inventory
-            exchanges = []
-
-            # Add production flow to exchanges
-            exchanges.append(get_production_flow_exchange(up_dict))
-
-            for index, row in simulation_results_data[
-                simulation_results_data["Unit Name"] == up
-            ].iterrows():
-
-                if row["LCI type"] == "technosphere":
-
-                    exc_filter = {
-                        "name": self.simulation_lci_map[row["Stream Name"]]["Name"],
-                        "product": self.simulation_lci_map[row["Stream Name"]][
-                            "Reference product"
-                        ],
-                        "unit": row["Unit"],
-                    }
-
-                    try:
-                        exc_dataset = get_dataset_for_location(
-                            activity_location, exc_filter, self.ecoinvent_db
-                        )
-                    except IndexError:
-                        raise ValueError(f"No LCI dataset available for {exc_filter}")
-
-                    exchanges.append(
-                        {
-                            "name": exc_dataset["name"],
-                            "product": exc_dataset["reference product"],
-                            "location": exc_dataset["location"],
-                            "amount": row["Amount"],
-                            "unit": row["Unit"],
-                            "database": self.source_db,
-                            "type": "technosphere",
-                        }
-                    )
-
-                elif row["LCI type"] == "biosphere":
-                    categories = (
-                        self.simulation_lci_map[row["Stream Name"]]["Category"],
-                        self.simulation_lci_map[row["Stream Name"]]["Subcategory"],
-                    )
-                    if isinstance(categories[1], float) and math.isnan(categories[1]):
-                        categories = (categories[0],)
-
-                    exchanges.append(
-                        {
-                            "name": self.simulation_lci_map[row["Stream Name"]]["Name"],
-                            "amount": row["Amount"],
-                            "unit": row["Unit"],
-                            "categories": categories,
-                            "database": "biosphere3",
-                            "type": "biosphere",
-                        }
-                    )
+            # Add production flow and simulated flows to exchanges
+            exchanges = [get_production_flow_exchange(up_dict)] + [
+                self._get_exchange(row, activity_location)
+                for row in up_rows.itertuples(index=False)
+                if row.lci_type in ("technosphere", "biosphere")
+            ]
 
             up_dict.update({"exchanges": exchanges})
             inventories.append(up_dict)
@@ -334,24 +424,20 @@ class Converter:
             "code": get_dataset_code(),
             "comment": activity_comment,
         }
-        activity_exchanges = []
-
-        # Add production flow to exchanges
-        activity_exchanges.append(get_production_flow_exchange(activity_dic))
-
-        # Add unit processes to exchanges
-        for up in inventories:
-            activity_exchanges.append(
-                {
-                    "name": up["name"],
-                    "product": up["reference product"],
-                    "amount": 1,
-                    "unit": up["unit"],
-                    "database": up["database"],
-                    "location": up["location"],
-                    "type": "technosphere",
-                }
-            )
+
+        # Add production flow and unit processes to exchanges
+        activity_exchanges = [get_production_flow_exchange(activity_dic)] + [
+            {
+                "name": up["name"],
+                "product": up["reference product"],
+                "amount": 1,
+                "unit": up["unit"],
+                "database": up["database"],
+                "location": up["location"],
+                "type": "technosphere",
+            }
+            for up in inventories
+        ]
 
         activity_dic.update({"exchanges": activity_exchanges})
         inventories.append(activity_dic)
@@ -360,16 +446,21 @@ class Converter:
             "Linking datasets within the database and to ecoinvent and biosphere databases"
         )
 
-        link_exchanges_by_code(inventories, self.ecoinvent_db, self.biosphere_db)
+        link_exchanges_by_code(
+            inventories,
+            self.ecoinvent_db,
+            self.biosphere_db,
+            self._ecoinvent_technosphere_index,
+        )
 
         print("Done!")
 
         return inventories
 
-    def create_lci_database(self):
+    def create_lci_database(self, export_format: str = "xlsx"):
         """
         Write the inventort database to Brightway and export the inventories to
-        Excel file
+        Excel file, or to Parquet file if `export_format` is "parquet"
         """
         inventories = self.format_inventories_for_bw()
         new_db_name = self.metadata["activity description"]["database"]
@@ -380,15 +471,15 @@ class Converter:
 
         filepath = (
             self.export_dir
-            / f"{new_db_name}_{datetime.datetime.today().strftime('%d-%m-%Y')}.xlsx"
+            / f"{new_db_name}_{datetime.datetime.today().strftime('%d-%m-%Y')}.{export_format}"
         )
 
         print(
-            "Writing LCI database to Brightway2 and exporting inventories in Excel file..."
+            f"Writing LCI database to Brightway2 and exporting inventories in {export_format} file..."
         )
-        export_path = write_db_to_bw(inventories, new_db_name)
+        export_path = write_db_to_bw(inventories, new_db_name, export_format)
 
-        # Copy the Excel file to the current location
+        # Copy the exported file to the current location
         shutil.copy(export_path, filepath)
 
         return f"Database created and inventories exported to: {filepath}"
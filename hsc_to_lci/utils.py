@@ -5,20 +5,98 @@ which could be used in multiplace places.
 
 import pandas as pd
 import yaml
-import copy
+import functools
+import importlib.util
+import os
+import pickle
+import tempfile
+import warnings
+from collections import defaultdict
+from pathlib import Path
 import brightway2 as bw
 import bw2io
 import wurst
 from constructive_geometries import *
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 from . import __version__, DATA_DIR
 
 
 ECOINVENT_UNITS = DATA_DIR / "export" / "ecoinvent_units.yaml"
 GASES_PROPERTIES = DATA_DIR / "export" / "gases_properties.yaml"
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "hsc_to_lci"
+)
+
+# Lowercase names of the streams whose units are converted in `units_conversion`
+CONVERT_KG_TO_CUM = frozenset(["natural gas", "air", "h2o(g)"])
+CONVERT_KWH_TO_MJ = frozenset(["thermal energy flow", "heat flow"])
+
+
+def get_database_cache_file(db_name: str) -> Path:
+    """
+    Path of the pickled copy of a database of the current Brightway project
+    """
+    return CACHE_DIR / Path(bw.projects.dir).name / f"{db_name}.pickle"
+
+
+def read_database_cache(db_name: str):
+    """
+    Load a database exported by `write_database_cache`, provided the database
+    has not been modified in Brightway since.
+    :param db_name: name of the Brightway database
+    :return: list of dictionaries, or None if there is no valid cache
+    """
+    cache_file = get_database_cache_file(db_name)
+    if not cache_file.exists():
+        return None
+
+    # A truncated or incompatible cache is simply rebuilt
+    try:
+        with open(cache_file, "rb") as stream:
+            cache = pickle.load(stream)
+
+        if cache["modified"] != bw.databases[db_name].get("modified"):
+            return None
+
+        return cache["data"]
+    except Exception:
+        return None
+
+
+def write_database_cache(db_name: str, data: list):
+    """
+    Pickle a database exported as a list of dictionaries, together with
+    its modification time in Brightway. A failed write only emits a warning.
+    :param db_name: name of the Brightway database
+    :param data: list of dictionaries
+    """
+    cache_file = get_database_cache_file(db_name)
+    cache = {"modified": bw.databases[db_name].get("modified"), "data": data}
+
+    # The cache only saves time: failing to write it must not stop the import
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write next to the cache file and swap it in, so that an interrupted
+        # dump never leaves a truncated cache behind
+        fd, tmp_file = tempfile.mkstemp(dir=cache_file.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as stream:
+                pickle.dump(cache, stream, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except BaseException:
+            os.unlink(tmp_file)
+            raise
+    except (OSError, pickle.PicklingError) as err:
+        warnings.warn(f"Could not cache database {db_name} in {cache_file}: {err}")
 
 
-def import_ecoinvent_as_dict(source_db: str):
+def import_ecoinvent_as_dict(source_db: str, use_cache: bool = True):
     """
     Import the ecoinvent database into wurst format
     """
@@ -27,29 +105,49 @@ def import_ecoinvent_as_dict(source_db: str):
     if source_db not in bw.databases:
         raise ValueError(f"Database {source_db} not found")
 
-    db_dict = [ds.as_dict() for ds in bw.Database(source_db)]
+    db_dict = read_database_cache(source_db) if use_cache else None
+    if db_dict is None:
+        db_dict = [ds.as_dict() for ds in bw.Database(source_db)]
+        if use_cache:
+            write_database_cache(source_db, db_dict)
 
     return db_dict
 
 
-def import_biosphere_as_dict():
+def import_biosphere_as_dict(use_cache: bool = True):
     print("Importing the biosphere database...")
 
     if "biosphere3" not in bw.databases:
         raise ValueError(f"Database biosphere not found")
 
-    bio_db = [ef.as_dict() for ef in bw.Database("biosphere3")]
+    bio_db = read_database_cache("biosphere3") if use_cache else None
+    if bio_db is None:
+        bio_db = [ef.as_dict() for ef in bw.Database("biosphere3")]
+        if use_cache:
+            write_database_cache("biosphere3", bio_db)
 
     return bio_db
 
 
+@functools.lru_cache(maxsize=None)
 def get_ecoinvent_units():
-    with open(ECOINVENT_UNITS, "r") as stream:
-        try:
-            data = yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
-    return data
+    """
+    Load the mapping of simulation units to ecoinvent units.
+    The file is parsed once; the returned dict is shared and must not be modified.
+    """
+    return yaml.load(ECOINVENT_UNITS.read_bytes(), Loader=SafeLoader)
+
+
+def get_excel_engine():
+    """
+    Use the Rust-based calamine reader when python-calamine is installed
+    (supported from pandas 2.2), otherwise let pandas choose its default engine.
+    :return: engine name or None
+    """
+    pandas_version = tuple(int(i) for i in pd.__version__.split(".")[:2])
+    if pandas_version >= (2, 2) and importlib.util.find_spec("python_calamine"):
+        return "calamine"
+    return None
 
 
 def get_simulation_lci_map(filepath: str):
@@ -58,7 +156,7 @@ def get_simulation_lci_map(filepath: str):
     :param filepath:
     :return: dict
     """
-    df = pd.read_excel(filepath, index_col=0)
+    df = pd.read_excel(filepath, index_col=0, engine=get_excel_engine())
 
     if df.index.duplicated().any():
         duplicate_indices = list(df.index[df.index.duplicated(keep=False)])
@@ -66,16 +164,16 @@ def get_simulation_lci_map(filepath: str):
             f"Mapping file contains duplicated stream: {duplicate_indices}"
         )
 
-    return {index: row.to_dict() for index, row in df.iterrows()}
+    return df.to_dict(orient="index")
 
 
+@functools.lru_cache(maxsize=None)
 def get_gases_properties():
-    with open(GASES_PROPERTIES, "r") as stream:
-        try:
-            data = yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
-    return data
+    """
+    Load the properties (density) of the gases converted to cubic meters.
+    The file is parsed once; the returned dict is shared and must not be modified.
+    """
+    return yaml.load(GASES_PROPERTIES.read_bytes(), Loader=SafeLoader)
 
 
 def get_dataset_code():
@@ -89,34 +187,25 @@ def units_conversion(df):
     :return: DataFrame object with adjusted units
     """
 
-    convert_kg_to_cum = ["natural gas", "air", "h2o(g)"]
-
-    convert_kwh_to_mj = ["thermal energy flow", "heat flow"]
-
     gases_properties = get_gases_properties()
 
-    df_updated = df.copy()
-
-    for index, row in df_updated.iterrows():
+    stream_names = df["Stream Name"].str.lower()
 
-        if row["Stream Name"].lower() in convert_kg_to_cum:
-            if row["Unit"] == "cubic meter":
-                pass
-            else:
-                if row["Unit"] == "kilogram":
-                    df_updated.at[index, "Amount"] /= gases_properties[
-                        row["Stream Name"].lower()
-                    ]["density"]
-                df_updated.at[index, "Unit"] = "cubic meter"
+    # Gases: kilogram (or other units) to cubic meter
+    is_gas = stream_names.isin(CONVERT_KG_TO_CUM) & df["Unit"].ne("cubic meter")
+    is_gas_in_kg = is_gas & df["Unit"].eq("kilogram")
+    density = stream_names.map(
+        {name: properties["density"] for name, properties in gases_properties.items()}
+    )
+    df.loc[is_gas_in_kg, "Amount"] = (
+        df.loc[is_gas_in_kg, "Amount"] / density[is_gas_in_kg]
+    )
+    df.loc[is_gas, "Unit"] = "cubic meter"
 
-        if row["Stream Name"].lower() in convert_kwh_to_mj:
-            if row["Unit"] == "megajoule":
-                pass
-            else:
-                df_updated.at[index, "Amount"] *= 3.6
-                df_updated.at[index, "Unit"] = "megajoule"
-
-    df.update(df_updated)
+    # Heat: kilowatt hour (or other units) to megajoule
+    is_heat = stream_names.isin(CONVERT_KWH_TO_MJ) & df["Unit"].ne("megajoule")
+    df.loc[is_heat, "Amount"] = df.loc[is_heat, "Amount"] * 3.6
+    df.loc[is_heat, "Unit"] = "megajoule"
 
 
 def get_production_flow_exchange(ds: dict):
@@ -137,7 +226,68 @@ def get_production_flow_exchange(ds: dict):
     }
 
 
-def get_dataset_for_location(loc: str, exc_filter: dict, ei_db: list):
+def build_ecoinvent_index(ei_db: list) -> dict:
+    """
+    Group ecoinvent datasets by name, reference product, and unit,
+    i.e., the fields matched by 'wurst.transformations.geo.get_possibles'
+
+    :param ei_db: list of dictionaries containing ecoinvent inventories
+    :return: dictionary mapping (name, reference product, unit) to a list of datasets
+    """
+    ei_index = defaultdict(list)
+    for ds in ei_db:
+        ei_index[(ds["name"], ds["reference product"], ds["unit"])].append(ds)
+
+    return dict(ei_index)
+
+
+def get_possible_datasets(exc_filter: dict, ei_db: list, ei_index: dict = None):
+    """
+    Get all datasets matching the name, reference product, and unit of the filter,
+    using the index from `build_ecoinvent_index` when available.
+
+    :param exc_filter: dictionary containing the name, reference product, and unit for the activity
+    :param ei_db: list of dictionaries containing ecoinvent inventories
+    :param ei_index: optional index of `ei_db` built with `build_ecoinvent_index`
+    :return: list of datasets
+    """
+    if ei_index is None:
+        return list(wurst.transformations.geo.get_possibles(exc_filter, ei_db))
+
+    return ei_index.get(
+        (exc_filter["name"], exc_filter["product"], exc_filter["unit"]), []
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_geomatcher():
+    """
+    Shared Geomatcher object; loading its topology is expensive.
+    """
+    return Geomatcher()
+
+
+@functools.lru_cache(maxsize=4096)
+def get_supraregional_locations(loc: str) -> tuple:
+    """
+    Get the locations intersecting the provided location, from smallest to biggest,
+    with "RoW" inserted before "GLO".
+
+    :param loc: string representing the target location
+    :return: tuple of location names
+    """
+    loc_intersection = get_geomatcher().intersects(loc, biggest_first=False)
+    loc_intersection = [i[1] if type(i) == tuple else i for i in loc_intersection]
+    loc_intersection.insert(
+        loc_intersection.index("GLO"), "RoW"
+    )  # Insert RoW before GLO
+
+    return tuple(loc_intersection)
+
+
+def get_dataset_for_location(
+    loc: str, exc_filter: dict, ei_db: list, ei_index: dict = None
+):
     """
     Find new technosphere suppliers for the provided location.
     Based on 'wurst.transformations.geo.relink_technosphere_exchanges'
@@ -145,50 +295,63 @@ def get_dataset_for_location(loc: str, exc_filter: dict, ei_db: list):
     :param loc: string representing the target location
     :param exc_filter: dictionary containing the name, reference product, and unit for the activity
     :param ei_db: list of dictionaries containing ecoinvent inventories
+    :param ei_index: optional index of `ei_db` built with `build_ecoinvent_index`
     :return: dictionary containing the dataset
     """
-    geomatcher = Geomatcher()  # Initialize the geomatcher object
-
     # Get all possible datasets for all locations; get both "market group" and "market" activities
     if "market for" in exc_filter["name"]:
-        possible_datasets_market = list(
-            wurst.transformations.geo.get_possibles(exc_filter, ei_db)
-        )
-
-        exc_filter_market = copy.deepcopy(exc_filter)
-        exc_filter_market.update(
-            {"name": exc_filter["name"].replace("market", "market group")}
-        )
-        possible_datasets_market_group = list(
-            wurst.transformations.geo.get_possibles(exc_filter_market, ei_db)
+        possible_datasets_market = get_possible_datasets(exc_filter, ei_db, ei_index)
+
+        exc_filter_market = {
+            **exc_filter,
+            "name": exc_filter["name"].replace("market", "market group"),
+        }
+        possible_datasets_market_group = get_possible_datasets(
+            exc_filter_market, ei_db, ei_index
         )
 
         possible_datasets = possible_datasets_market + possible_datasets_market_group
     else:
-        possible_datasets = list(
-            wurst.transformations.geo.get_possibles(exc_filter, ei_db)
-        )
+        possible_datasets = get_possible_datasets(exc_filter, ei_db, ei_index)
+
+    # First possible dataset for each location
+    datasets_by_location = {}
+    for ds in possible_datasets:
+        datasets_by_location.setdefault(ds["location"], ds)
 
     # Check if there is an exact match for the target location
-    match_dataset = [ds for ds in possible_datasets if ds["location"] == loc]
+    if loc in datasets_by_location:
+        return datasets_by_location[loc]
 
     # If there is no specific dataset for the target location, search for the supraregional locations
-    if len(match_dataset) == 0:
-        loc_intersection = geomatcher.intersects(loc, biggest_first=False)
-        loc_intersection = [i[1] if type(i) == tuple else i for i in loc_intersection]
-        loc_intersection.insert(
-            loc_intersection.index("GLO"), "RoW"
-        )  # Inser RoW before GLO
+    for supraregional_loc in get_supraregional_locations(loc):
+        if supraregional_loc in datasets_by_location:
+            return datasets_by_location[supraregional_loc]
 
-        for loc in loc_intersection:
-            match_dataset = [ds for ds in possible_datasets if ds["location"] == loc]
-            if len(match_dataset) > 0:
-                break
+    raise IndexError(f"No dataset found for {exc_filter} in {loc}")
 
-    return match_dataset[0]
 
+def build_technosphere_index(datasets, tech_index: dict = None) -> dict:
+    """
+    Index datasets by name, reference product, and location, i.e., the fields
+    technosphere exchanges are linked on. Keys matching several datasets are
+    ambiguous and mapped to None.
 
-def link_exchanges_by_code(inventories: list, ei_db: list, bio_db: list):
+    :param datasets: iterable of dictionaries containing inventories
+    :param tech_index: optional index to extend; it is copied, not modified
+    :return: dictionary mapping (name, reference product, location) to (database, code)
+    """
+    tech_index = dict(tech_index) if tech_index else {}
+    for ds in datasets:
+        key = (ds["name"], ds["reference product"], ds["location"])
+        tech_index[key] = None if key in tech_index else (ds["database"], ds["code"])
+
+    return tech_index
+
+
+def link_exchanges_by_code(
+    inventories: list, ei_db: list, bio_db: list, ei_tech_index: dict = None
+):
     """
     This function links in place technosphere exchanges within the database and/or to an external database
     and biosphere exchanges with the biosphere database (only unlinked exchanges)
@@ -196,40 +359,34 @@ def link_exchanges_by_code(inventories: list, ei_db: list, bio_db: list):
     :param inventories: list of dictionaries containing inventories
     :param ei_db: list of dictionaries containing ecoinvent inventories
     :param bio_db: list of dictionaries containing biosphere flows metadata
+    :param ei_tech_index: optional index of `ei_db` built with `build_technosphere_index`
     """
-    technosphere = lambda x: x["type"] == "technosphere"
-    biosphere = lambda x: x["type"] == "biosphere"
+    # Index datasets and biosphere flows by the fields exchanges are matched on
+    if ei_tech_index is None:
+        ei_tech_index = build_technosphere_index(ei_db)
+    tech_index = build_technosphere_index(inventories, ei_tech_index)
+
+    bio_index = {}
+    for ef in bio_db:
+        key = (ef["name"], ef["unit"], tuple(ef["categories"]))
+        bio_index.setdefault(key, ef["code"])
 
     for ds in inventories:
+        for exc in ds["exchanges"]:
+            if "input" in exc:
+                continue
+
+            if exc["type"] == "technosphere":
+                key = (exc["name"], exc["product"], exc["location"])
+                if tech_index.get(key) is None:
+                    raise ValueError(f"No unique dataset found for exchange {key}")
+                exc["input"] = tech_index[key]
 
-        for exc in filter(technosphere, ds["exchanges"]):
-            if "input" not in exc:
-                try:
-                    exc_lci = wurst.get_one(
-                        inventories + ei_db,
-                        wurst.equals("name", exc["name"]),
-                        wurst.equals("reference product", exc["product"]),
-                        wurst.equals("location", exc["location"]),
-                    )
-                    exc.update({"input": (exc_lci["database"], exc_lci["code"])})
-                except Exception:
-                    print(exc["name"], exc["product"], exc["location"])
-                    raise
-
-        for exc in filter(biosphere, ds["exchanges"]):
-            if "input" not in exc:
-                try:
-                    ef_code = [
-                        ef["code"]
-                        for ef in bio_db
-                        if ef["name"] == exc["name"]
-                        and ef["unit"] == exc["unit"]
-                        and ef["categories"] == exc["categories"]
-                    ][0]
-                    exc.update({"input": ("biosphere3", ef_code)})
-                except Exception:
-                    print(exc["name"], exc["unit"], exc["categories"])
-                    raise
+            elif exc["type"] == "biosphere":
+                key = (exc["name"], exc["unit"], tuple(exc["categories"]))
+                if key not in bio_index:
+                    raise ValueError(f"No biosphere flow found for exchange {key}")
+                exc["input"] = ("biosphere3", bio_index[key])
 
 
 def load_project_metadata(filepath: str) -> dict:
@@ -239,24 +396,60 @@ def load_project_metadata(filepath: str) -> dict:
     :return: metadata
     """
     # read YAML file
-    with open(filepath, "r") as stream:
-        try:
-            data = yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
+    return yaml.load(Path(filepath).read_bytes(), Loader=SafeLoader)
 
-    return data
 
+def get_exchanges_as_dataframe(inventories: list) -> pd.DataFrame:
+    """
+    Flatten inventories into a table with one row per exchange
 
-def write_db_to_bw(inventories: list, db_name: str):
+    :param inventories: list of dictionary each containing a dataset
+    :return: DataFrame with the dataset and exchange fields of each exchange
+    """
+    return pd.DataFrame(
+        [
+            {
+                "activity name": ds["name"],
+                "activity reference product": ds["reference product"],
+                "activity location": ds["location"],
+                "activity database": ds["database"],
+                "activity code": ds["code"],
+                "name": exc["name"],
+                "product": exc.get("product"),
+                "location": exc.get("location"),
+                "categories": list(exc["categories"]) if "categories" in exc else None,
+                "amount": exc["amount"],
+                "unit": exc["unit"],
+                "database": exc["database"],
+                "type": exc["type"],
+                "input": list(exc["input"]),
+            }
+            for ds in inventories
+            for exc in ds["exchanges"]
+        ]
+    )
+
+
+def write_db_to_bw(inventories: list, db_name: str, export_format: str = "xlsx"):
     """
-    Write database to Brightway2 and export inventory in Excel
+    Write database to Brightway2 and export inventory in Excel, or in Parquet
+    (requires pyarrow) which is much faster to write for large databases
 
     :param inventories: list of dictionary each containing a dataset
     :param: db_name: name of the new database
+    :param export_format: "xlsx" or "parquet"
+    :return: path of the exported file
     """
+    if export_format not in ("xlsx", "parquet"):
+        raise ValueError(f"Unsupported export format: {export_format}")
+
     if db_name in bw.databases:
         del bw.databases[db_name]
     wurst.write_brightway2_database(inventories, db_name)
 
+    if export_format == "parquet":
+        filepath = Path(bw.projects.output_dir) / f"{db_name}.parquet"
+        get_exchanges_as_dataframe(inventories).to_parquet(filepath, compression="zstd")
+        return filepath
+
     return bw2io.export.excel.write_lci_excel(db_name)
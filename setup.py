@@ -10,6 +10,10 @@ setup(
     install_requires=[
         "brightway2",
     ],
+    extras_require={
+        "calamine": ["python-calamine"],
+        "parquet": ["pyarrow"],
+    },
     url="https://github.com/robyistrate/hsc_to_lci",
     description="Convert HSC Chemistry simulation results to Brightway-format life cycle inventories",
     long_description=open('README.md').read(),